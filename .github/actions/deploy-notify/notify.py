@@ -1,21 +1,53 @@
 #!/usr/bin/env python3
+import dataclasses
+import functools
+import http.client
 import json
 import os
 import pathlib
+import random
 import re
+import shutil
+import ssl
 import subprocess
-import urllib.error
-import urllib.request
+import threading
+import time
+import urllib.parse
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
 
 
 COMMIT_TYPE_RE = re.compile(r"^(?P<type>[a-zA-Z]+)(?:\([^)]*\))?!?:\s*(?P<rest>.+)$")
+FILES_CHANGED_RE = re.compile(r"(\d+)\s+files?\s+changed")
+INSERTIONS_RE = re.compile(r"(\d+)\s+insertions?\(\+\)")
+DELETIONS_RE = re.compile(r"(\d+)\s+deletions?\(-\)")
+WHITESPACE_RE = re.compile(r"\s+")
+DISCORD_CONTENT_LIMIT = 1900
+BEFORE_SHA_RE = re.compile(rb'"before"\s*:\s*"([0-9a-f]{40})"')
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504, 524, 529}
+MAX_POST_ATTEMPTS = 5
+RETRY_BUDGET_SECONDS = 60.0
 FEATURE_TYPES = {"feat", "feature"}
 IMPROVEMENT_PREFIXES = ("fix", "bug", "perf", "refactor", "chore", "build", "ci", "docs", "test", "style")
 FEATURE_PREFIXES = ("add ", "adds ", "introduce ", "introduces ", "support ", "supports ", "enable ", "enables ", "new ")
 
 
+# One stripped snapshot of the environment at import; env() never goes
+# back to os.environ.
+_ENV = {key: value.strip() for key, value in os.environ.items()}
+
+
 def env(name: str, default: str = "") -> str:
-    return (os.getenv(name) or default).strip()
+    return _ENV.get(name) or default.strip()
 
 
 def to_int(value: str, default: int) -> int:
@@ -25,10 +57,44 @@ def to_int(value: str, default: int) -> int:
         return default
 
 
-def git(*args: str) -> str:
-    return subprocess.check_output(["git", *args], text=True).strip()
+@dataclasses.dataclass(slots=True, frozen=True)
+class Ctx:
+    webhook_url: str
+    max_commits: int
+    repo: str
+    branch: str
+    actor: str
+    after_sha: str
+    run_url: str
+    job_status: str
+
 
+@functools.lru_cache(maxsize=1)
+def load_ctx() -> Ctx:
+    repo = env("GITHUB_REPOSITORY")
+    return Ctx(
+        webhook_url=env("CH_DISCORD_WEBHOOK_URL"),
+        max_commits=to_int(env("CH_MAX_COMMITS", "8"), 8),
+        repo=repo,
+        branch=env("GITHUB_REF_NAME"),
+        actor=env("GITHUB_ACTOR"),
+        after_sha=env("GITHUB_SHA"),
+        run_url=f"{env('GITHUB_SERVER_URL')}/{repo}/actions/runs/{env('GITHUB_RUN_ID')}",
+        job_status=env("CH_JOB_STATUS", "unknown").lower(),
+    )
 
+
+# Resolve git once and hand child processes a minimal environment so
+# each call skips PATH lookup and copying the full Actions env block.
+_GIT = shutil.which("git") or "git"
+_GIT_ENV = {
+    "PATH": os.environ.get("PATH", ""),
+    "HOME": os.environ.get("HOME", "/"),
+    "GIT_OPTIONAL_LOCKS": "0",
+    "LC_ALL": "C",
+}
+
+@functools.lru_cache(maxsize=1)
 def read_event_before_sha() -> str:
     event_path = env("GITHUB_EVENT_PATH")
     if not event_path:
@@ -37,14 +103,25 @@ def read_event_before_sha() -> str:
     if not p.exists():
         return ""
     try:
-        payload = json.loads(p.read_text())
+        raw = p.read_bytes()
+    except Exception:
+        return ""
+    # Push payloads run to hundreds of KB; grab the before sha with a
+    # byte scan and only fall back to a full JSON parse on a miss.
+    match = BEFORE_SHA_RE.search(raw)
+    if match:
+        return match.group(1).decode("ascii")
+    try:
+        payload = _loads(raw)
     except Exception:
         return ""
     before = payload.get("before")
     return before.strip() if isinstance(before, str) else ""
 
 
-def build_commits(before_sha: str, after_sha: str, max_commits: int) -> list[dict[str, str]]:
+def build_commits(
+    before_sha: str, after_sha: str, max_commits: int
+) -> tuple[list[dict[str, str]], dict[str, int]]:
     zero = "0" * 40
     has_before = bool(before_sha) and before_sha != zero
     has_after = bool(after_sha)
@@ -56,43 +133,77 @@ def build_commits(before_sha: str, after_sha: str, max_commits: int) -> list[dic
     else:
         rev = "HEAD"
 
-    try:
-        raw = git(
-            "log",
-            "--no-merges",
-            f"--max-count={max_commits}",
-            "--pretty=format:%h%x1f%s%x1f%an",
-            rev,
-        )
-    except Exception:
-        raw = ""
-
     commits: list[dict[str, str]] = []
-    for line in raw.splitlines():
-        parts = line.split("\x1f")
+    stats = {"files_changed": 0, "insertions": 0, "deletions": 0}
+
+    def flush_record(record: list[str]) -> None:
+        if not record:
+            return
+        parts = record[0].split("\x1f")
         if len(parts) != 3:
-            continue
+            return
+        # %x1f delimiters guarantee no stray whitespace around fields.
         short_sha, subject, author = parts
         commits.append(
             {
-                "short_sha": short_sha.strip(),
-                "subject": subject.strip(),
-                "author": author.strip(),
+                # Cap pathological squash/merge subjects early; the
+                # renderer trims to its own display length anyway.
+                "short_sha": short_sha,
+                "subject": subject[:200],
+                "author": author,
             }
         )
-    return commits
+        commit_stats = parse_shortstat("\n".join(record[1:]))
+        stats["files_changed"] += commit_stats["files_changed"]
+        stats["insertions"] += commit_stats["insertions"]
+        stats["deletions"] += commit_stats["deletions"]
+
+    try:
+        with subprocess.Popen(
+            [
+                _GIT,
+                "log",
+                "--no-merges",
+                "--shortstat",
+                f"--max-count={max_commits}",
+                "--pretty=format:%x1e%h%x1f%s%x1f%an",
+                rev,
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            env=_GIT_ENV,
+        ) as proc:
+            record: list[str] = []
+            for line in proc.stdout:
+                line = line.rstrip("\n")
+                if line.startswith("\x1e"):
+                    flush_record(record)
+                    if len(commits) >= max_commits:
+                        record = []
+                        break
+                    record = [line[1:]]
+                elif record:
+                    record.append(line)
+            flush_record(record)
+    except Exception:
+        pass
+    return commits, stats
+
+
+_REPO_SEP_TABLE = str.maketrans({"_": "-"})
 
 
 def normalize_repo_name(repo: str) -> str:
-    short = repo.split("/")[-1] if repo else "repo"
-    pieces = [p for p in short.replace("_", "-").split("-") if p]
-    return " ".join(p.capitalize() for p in pieces) if pieces else short
+    short = repo.rpartition("/")[2] or "repo"
+    pieces = short.translate(_REPO_SEP_TABLE).split("-")
+    return " ".join(p[:1].upper() + p[1:] for p in pieces if p) or short
 
 
 def parse_shortstat(raw: str) -> dict[str, int]:
-    files_match = re.search(r"(\d+)\s+files?\s+changed", raw)
-    insertions_match = re.search(r"(\d+)\s+insertions?\(\+\)", raw)
-    deletions_match = re.search(r"(\d+)\s+deletions?\(-\)", raw)
+    files_match = FILES_CHANGED_RE.search(raw)
+    insertions_match = INSERTIONS_RE.search(raw)
+    deletions_match = DELETIONS_RE.search(raw)
     return {
         "files_changed": int(files_match.group(1)) if files_match else 0,
         "insertions": int(insertions_match.group(1)) if insertions_match else 0,
@@ -100,20 +211,6 @@ def parse_shortstat(raw: str) -> dict[str, int]:
     }
 
 
-def build_change_stats(before_sha: str, after_sha: str) -> dict[str, int]:
-    zero = "0" * 40
-    try:
-        if before_sha and before_sha != zero and after_sha:
-            raw = git("diff", "--shortstat", before_sha, after_sha)
-        elif after_sha:
-            raw = git("diff-tree", "--shortstat", "--no-commit-id", "--root", "-r", after_sha)
-        else:
-            raw = git("diff-tree", "--shortstat", "--no-commit-id", "--root", "-r", "HEAD")
-    except Exception:
-        raw = ""
-    return parse_shortstat(raw)
-
-
 def classify_subject(subject: str) -> str:
     if not subject:
         return "Fixes / Improvements"
@@ -134,12 +231,32 @@ def classify_subject(subject: str) -> str:
 
 
 def summarize_subject(subject: str, max_len: int = 110) -> str:
-    cleaned = re.sub(r"\s+", " ", subject).strip() or "No subject"
+    if (
+        subject
+        and len(subject) <= max_len
+        and "  " not in subject
+        and "\t" not in subject
+        and "\n" not in subject
+    ):
+        return subject.strip()
+    cleaned = WHITESPACE_RE.sub(" ", subject).strip() or "No subject"
     if len(cleaned) <= max_len:
         return cleaned
     return cleaned[: max_len - 3].rstrip() + "..."
 
 
+def join_lines_capped(lines: list[str], max_chars: int = DISCORD_CONTENT_LIMIT) -> str:
+    kept: list[str] = []
+    total = 0
+    for line in lines:
+        extra = len(line) + (1 if kept else 0)
+        if total + extra > max_chars:
+            break
+        kept.append(line)
+        total += extra
+    return "\n".join(kept).strip()
+
+
 def render_success_copy(
     *,
     repo_name: str,
@@ -175,7 +292,7 @@ def render_success_copy(
             ),
         ]
     )
-    return "\n".join(lines).strip()
+    return join_lines_capped(lines)
 
 
 def generate_failure_copy(*, repo_name: str, branch: str, actor: str, run_url: str) -> str:
@@ -187,71 +304,145 @@ def generate_failure_copy(*, repo_name: str, branch: str, actor: str, run_url: s
         "",
         f"Run: <{run_url}>",
     ]
-    return "\n".join(lines).strip()
+    return join_lines_capped(lines)
+
+
+_SSL_CONTEXT = ssl.create_default_context()
+
+# Keep-alive connections keyed by netloc so repeat calls to the same
+# host (retries, future extra webhooks) reuse one TLS handshake.
+_CONNECTIONS: dict[str, http.client.HTTPSConnection] = {}
+
+
+def get_connection(netloc: str) -> http.client.HTTPSConnection:
+    conn = _CONNECTIONS.get(netloc)
+    if conn is None:
+        conn = http.client.HTTPSConnection(netloc, timeout=20, context=_SSL_CONTEXT)
+        _CONNECTIONS[netloc] = conn
+    return conn
+
+
+def warm_connection(netloc: str) -> None:
+    """Open the TCP+TLS connection ahead of time; best effort only.
+
+    Builds a private connection and publishes it to the cache only once
+    fully connected, so a concurrent get_connection never sees a
+    half-open socket.
+    """
+    try:
+        conn = http.client.HTTPSConnection(netloc, timeout=20, context=_SSL_CONTEXT)
+        conn.connect()
+    except Exception:
+        return
+    if _CONNECTIONS.setdefault(netloc, conn) is not conn:
+        conn.close()
+
+
+def drop_connection(netloc: str) -> None:
+    conn = _CONNECTIONS.pop(netloc, None)
+    if conn is not None:
+        conn.close()
+
+
+def close_connections() -> None:
+    for netloc in list(_CONNECTIONS):
+        drop_connection(netloc)
 
 
 def post_discord(webhook_url: str, content: str) -> None:
     payload = {"content": content[:1900]}
-    req = urllib.request.Request(
-        webhook_url,
-        data=json.dumps(payload).encode("utf-8"),
-        headers={
-            "Content-Type": "application/json",
-            "User-Agent": "curl/8.7.1",
-            "Accept": "application/json",
-        },
-    )
-    try:
-        with urllib.request.urlopen(req, timeout=20) as resp:
-            print(f"Discord webhook response: {resp.status}")
-    except urllib.error.HTTPError as exc:
-        body = ""
+    parts = urllib.parse.urlsplit(webhook_url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    data = _dumps(payload)
+    headers = {
+        "Content-Type": "application/json",
+        # Deliberate: Discord/Cloudflare treat some non-browser agents
+        # differently; see README.
+        "User-Agent": "curl/8.7.1",
+    }
+
+    deadline = time.monotonic() + RETRY_BUDGET_SECONDS
+    last_error = ""
+    for attempt in range(MAX_POST_ATTEMPTS):
+        retry_after = ""
         try:
-            body = exc.read().decode("utf-8", errors="replace")
-        except Exception:
-            pass
-        print(f"Discord webhook HTTPError: {exc.code} {exc.reason}; body={body}")
-        raise
+            conn = get_connection(parts.netloc)
+            conn.request("POST", path, body=data, headers=headers)
+            resp = conn.getresponse()
+        except (OSError, http.client.HTTPException) as exc:
+            drop_connection(parts.netloc)
+            last_error = str(exc) or type(exc).__name__
+            print(f"Discord webhook connection error: {last_error}")
+        else:
+            if resp.status < 400:
+                # Body is ignored on success; close without reading.
+                resp.close()
+                print(f"Discord webhook response: {resp.status}")
+                return
+            body = ""
+            try:
+                body = resp.read().decode("utf-8", errors="replace")
+            except Exception:
+                pass
+            print(f"Discord webhook error: {resp.status} {resp.reason}; body={body}")
+            if resp.status not in RETRYABLE_STATUSES:
+                raise RuntimeError(f"Discord webhook returned {resp.status}")
+            last_error = f"{resp.status} {resp.reason}"
+            retry_after = resp.getheader("Retry-After") or ""
+
+        delay = random.uniform(2, 4) * (attempt + 1)
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        if attempt + 1 == MAX_POST_ATTEMPTS or time.monotonic() + delay > deadline:
+            break
+        time.sleep(delay)
+
+    raise RuntimeError(f"Discord webhook failed after retries: {last_error}")
 
 
 def main() -> None:
-    webhook_url = env("CH_DISCORD_WEBHOOK_URL")
-    max_commits = to_int(env("CH_MAX_COMMITS", "8"), 8)
+    ctx = load_ctx()
 
-    if not webhook_url:
+    if not ctx.webhook_url:
         print("CH_DISCORD_WEBHOOK_URL is not set; skipping Discord notification.")
         return
 
-    repo = env("GITHUB_REPOSITORY")
-    repo_name = normalize_repo_name(repo)
-    branch = env("GITHUB_REF_NAME")
-    actor = env("GITHUB_ACTOR")
-    before_sha = read_event_before_sha()
-    after_sha = env("GITHUB_SHA")
-
-    run_url = f"{env('GITHUB_SERVER_URL')}/{repo}/actions/runs/{env('GITHUB_RUN_ID')}"
-    job_status = env("CH_JOB_STATUS", "unknown").lower()
+    # Overlap the TLS handshake to Discord with the git work below.
+    threading.Thread(
+        target=warm_connection,
+        args=(urllib.parse.urlsplit(ctx.webhook_url).netloc,),
+        daemon=True,
+    ).start()
 
-    commits = build_commits(before_sha, after_sha, max_commits)
-    stats = build_change_stats(before_sha, after_sha)
+    repo_name = normalize_repo_name(ctx.repo)
 
-    if job_status != "success":
+    # Failure copy never lists commits, so don't pay for git on that path.
+    if ctx.job_status != "success":
         content = generate_failure_copy(
             repo_name=repo_name,
-            branch=branch,
-            actor=actor,
-            run_url=run_url,
+            branch=ctx.branch,
+            actor=ctx.actor,
+            run_url=ctx.run_url,
         )
-        post_discord(webhook_url, content)
+        post_discord(ctx.webhook_url, content)
         return
 
+    before_sha = read_event_before_sha()
+    commits, stats = build_commits(before_sha, ctx.after_sha, ctx.max_commits)
+
     content = render_success_copy(
         repo_name=repo_name,
         commits=commits,
         stats=stats,
     )
-    post_discord(webhook_url, content)
+    post_discord(ctx.webhook_url, content)
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        close_connections()